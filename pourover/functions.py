@@ -10,18 +10,62 @@ This module contains parsing functions provided by pourover
 
 import re
 
-from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from sys import intern
 
 from .exceptions import CEFMessageError, IncompleteMessageError, UnsupportedValueError
 from .models import CEFMessage, CEFLog
+from .utils import is_escaped
 
 
-# regular expressions needed for parsing, kept out of the functions for ease of reading
-HEADER_SEP = r'(.*(?<!\\)\|){,7}(.*)'
-HEADER_SPLIT = r'(?<!\\)\|'
-SYSLOG_SEP = r'[a-zA-Z]{3}\s+[0-9]{,2}\s(?:[[0-9]{2}:*){3}\s+\w+'
-EXTENSION_MATCH = r'([^=\s]+)=((?:[\\]=|[^=])+)(?:\s|$)'
+# regular expressions needed for parsing, compiled once and kept out of the functions for ease of reading
+SYSLOG_SEP = re.compile(r'[a-zA-Z]{3}\s+[0-9]{,2}\s(?:[0-9]{2}:*){3}\s+\w+')
+
+# every CEF header is made up of exactly seven pipe-terminated fields
+HEADER_FIELD_COUNT = 7
+
+# roughly how many bytes of a file are handed to each worker when parsing in parallel
+PARSE_CHUNK_SIZE = 1 << 16
+
+
+def _split_header(line):
+    """ Split a CEF line into its header fields, raw header and extensions
+
+    Scan the line for the first seven unescaped pipe characters using ``str.find``. A pipe is considered escaped when it
+    is preceded by an odd number of backslashes. Headers that contain no backslashes at all are split with a single
+    ``str.split`` instead.
+
+    :param line: A CEF formatted line
+    :type line: str
+    :return: The list of header values, the raw header (including its final pipe) and the extensions, or ``None`` if
+        fewer than seven unescaped pipes were found
+    :rtype: tuple
+    """
+    header_values = line.split('|', HEADER_FIELD_COUNT)
+    if len(header_values) <= HEADER_FIELD_COUNT:
+        # There aren't enough pipes for a header, escaped or not
+        return None
+
+    extensions = header_values.pop()
+    header = line[:len(line) - len(extensions)]
+    if '\\' not in header:
+        # Nothing is escaped, so every pipe we split on was a field separator
+        return header_values, header, extensions.rstrip('\r\n')
+
+    header_values = []
+    start = 0
+    pos = line.find('|')
+    while pos != -1:
+        if not is_escaped(line, pos, start):
+            header_values.append(line[start:pos])
+            start = pos + 1
+            if len(header_values) == HEADER_FIELD_COUNT:
+                return header_values, line[:start], line[start:].rstrip('\r\n')
+
+        pos = line.find('|', pos + 1)
+
+    return None
 
 
 def parse_line(line):
@@ -35,82 +79,108 @@ def parse_line(line):
     :return: The parsed line object
     :rtype: :class:`CEFMessage <CEFMessage>`
     """
-    if not isinstance(line, str):
+    # Reject anything that isn't CEF before doing any real work
+    try:
+        cef_pos = line.find('CEF:')
+    except (AttributeError, TypeError):
         raise TypeError('CEF Lines must be strings')
-
-    # Create groups within the CEF line of the header (including a syslog prefix, if present)
-    split_at_header = re.search(HEADER_SEP, line)
-    if not split_at_header:
-        # If we can't match anything
+    if cef_pos == -1:
         raise CEFMessageError('A valid CEF header could not be found!')
 
-    header = split_at_header.group(1)
-    extensions = split_at_header.group(2)
-
-    if header is None:
-        # If a valid header couldn't be found
+    # Split the CEF line into each header field (including a syslog prefix, if present) - making sure not to split on
+    # escaped pipe characters on accident
+    split_at_header = _split_header(line)
+    if split_at_header is None:
+        # If we can't find seven unescaped pipes
         raise CEFMessageError('A valid CEF header could not be found!')
 
-    # Create some empty dicts for later
-    header_dict = OrderedDict()
-    extension_dict = OrderedDict()
+    header_values, header, extensions = split_at_header
+    if cef_pos >= len(header_values[0]):
+        # 'CEF:' only showed up after the first header field
+        raise CEFMessageError('A valid CEF header could not be found!')
 
-    # Now we want to split up our header - making sure not to split on escaped pipe characters on accident
-    header_values = re.split(HEADER_SPLIT, header)
+    # Create an empty dict for later
+    header_dict = {}
 
-    # First we need to determine if there's a syslog prefix
-    split_at_syslog_prefix = re.search(SYSLOG_SEP, header_values[0])
-    if split_at_syslog_prefix:
-        header_dict['Prefix'] = split_at_syslog_prefix.group(0)
+    # First we need to determine if there's a syslog prefix - there can only be one if something comes before 'CEF:'
+    if cef_pos > 0:
+        split_at_syslog_prefix = SYSLOG_SEP.search(header_values[0], 0, cef_pos)
+        if split_at_syslog_prefix:
+            header_dict['Prefix'] = split_at_syslog_prefix.group(0)
 
     # Add all headers into our dict
     try:
-        header_dict['Version'] = int(header_values[0].split(' ')[-1].split(':')[1])
+        header_dict['Version'] = int(header_values[0][cef_pos + 4:])
     except ValueError:
         raise UnsupportedValueError('The CEF Version field must be an integer!')
-    header_dict['DeviceVendor'] = header_values[1]
-    header_dict['DeviceProduct'] = header_values[2]
-    header_dict['DeviceVersion'] = header_values[3]
-    header_dict['DeviceEventClassID'] = header_values[4]
-    header_dict['Name'] = header_values[5]
+    # These values repeat across most lines of a log, so share a single copy of each
+    header_dict['DeviceVendor'] = intern(header_values[1])
+    header_dict['DeviceProduct'] = intern(header_values[2])
+    header_dict['DeviceVersion'] = intern(header_values[3])
+    header_dict['DeviceEventClassID'] = intern(header_values[4])
+    header_dict['Name'] = intern(header_values[5])
     try:
         header_dict['Severity'] = int(header_values[6])
     except ValueError:
         raise UnsupportedValueError('The CEF Severity field must be an integer!')
 
-    # Split up our extensions and insert them into their own dict
-    extension_pairs = re.findall(EXTENSION_MATCH, extensions)
-    for pair in extension_pairs:
-        extension_dict[pair[0]] = pair[1]
-
     # Create a CEFMessage object and populate it
     cefline = CEFMessage()
 
-    cefline.__setattr__('_extensions', extension_dict)
-    cefline.__setattr__('_headers', header_dict)
-    cefline.__setattr__('_raw_line', line)
-    cefline.__setattr__('_raw_header', header)
+    # The extensions are only split into their own dict once something asks for them
+    cefline._raw_extensions = extensions
+    cefline._headers = header_dict
+    cefline._raw_line = line
+    cefline._raw_header = header
 
     return cefline
 
 
-def parse_file(filepath):
+def _escape_header_value(value):
+    """ Escape any pipes in a header value so they aren't mistaken for field separators
+
+    Backslashes are left as they are, so a value whose backslashes would still escape a field separator (a trailing
+    backslash, or one right before a pipe) can't be written to a header and is refused.
+    """
+    escaped = value.replace('|', r'\|')
+    if '\\' in value:
+        if is_escaped(escaped, len(escaped)) or any(
+                char == '|' and not is_escaped(escaped, pos) for pos, char in enumerate(escaped)):
+            raise UnsupportedValueError('Header values can\'t contain a backslash that escapes a field separator!')
+    return escaped
+
+
+def _parse_lines(lines):
+    """ Parse a chunk of CEF formatted lines, used by worker processes in :func:`parse_file` """
+    return [parse_line(line) for line in lines]
+
+
+def parse_file(filepath, workers=None):
     """ Parse all messages in a CEF formatted log file
 
     Parse the data and fields from a file in CEF format and return them in a easy-to-manipulate list, breaking
     extensions into the key-value pairs presented in the log line
 
     :param filepath: The file to parse log lines from
+    :param workers: (optional) The number of worker processes to parse the file with. The file is read in chunks of
+        whole lines, which are parsed in parallel and added to the log in the order they appear in the file. Lines are
+        parsed in this process if not provided
     :type filepath: str
+    :type workers: int
     :return: The parsed log object
     :rtype: :class:`CEFLog <CEFLog>`
     """
     log = CEFLog()
     with open(filepath, 'r') as logfile:
-        messages = logfile.readlines()
-        for logline in messages:
-            line = parse_line(logline)
-            log.append(line)
+        if workers is None:
+            # Iterate over the file itself so lines are read as they're parsed, rather than all up front
+            log.extend(parse_line(logline) for logline in logfile)
+        else:
+            # readlines() with a size hint always stops at the end of a line
+            chunks = iter(lambda: logfile.readlines(PARSE_CHUNK_SIZE), [])
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                # Add every chunk in one go, so the log is only sorted once
+                log.extend(line for lines in executor.map(_parse_lines, chunks) for line in lines)
 
     return log
 
@@ -147,20 +217,36 @@ def create_line(version, dev_vendor, dev_product, dev_version, dev_event_class_i
     """
 
     # Replace any pipes provided in parameters with "escaped" pipes.
-    dev_vendor = dev_vendor.replace('|', '\|')
-    dev_product = dev_product.replace('|', '\|')
-    dev_version = dev_version.replace('|', '\|')
-    name = name.replace('|', '\|')
+    dev_vendor = _escape_header_value(dev_vendor)
+    dev_product = _escape_header_value(dev_product)
+    dev_version = _escape_header_value(dev_version)
+    dev_event_class_id = _escape_header_value(str(dev_event_class_id))
+    name = _escape_header_value(name)
+
+    # Validate these the same way parse_line will read them back out of the line, so e.g. floats and bools are refused
+    try:
+        version = int(str(version))
+    except (TypeError, ValueError):
+        raise UnsupportedValueError('The CEF Version field must be an integer!')
+    try:
+        severity = int(str(severity))
+    except (TypeError, ValueError):
+        raise UnsupportedValueError('The CEF Severity field must be an integer!')
+
+    header_dict = {}
 
     # Join our parameters into the header with a pipe character
     header = 'CEF:' + '|'.join(
-            [str(version), dev_vendor, dev_product, dev_version, str(dev_event_class_id), name, str(severity)]
+            [str(version), dev_vendor, dev_product, dev_version, dev_event_class_id, name, str(severity)]
     ) + '|'
 
     if set_syslog_prefix:
         if not hostname:
             # We need a hostname to create a syslog prefix
             raise IncompleteMessageError('No hostname was provided for the requests syslog prefix')
+        if '|' in hostname or 'CEF:' in hostname:
+            # Either would be read back as part of the CEF header rather than the prefix
+            raise UnsupportedValueError('The hostname can\'t contain a pipe or \'CEF:\'!')
         if timestamp:
             syslog_prefix = timestamp.strftime('%b %d %H:%M:%S')
         else:
@@ -169,16 +255,33 @@ def create_line(version, dev_vendor, dev_product, dev_version, dev_event_class_i
         # add the hostname to the prefix
         syslog_prefix = syslog_prefix + ' ' + hostname
 
+        # Keep the same part of the prefix that parse_line would find in this line
+        split_at_syslog_prefix = SYSLOG_SEP.search(syslog_prefix)
+        if split_at_syslog_prefix:
+            header_dict['Prefix'] = split_at_syslog_prefix.group(0)
+
         # add the prefix to the header
         header = syslog_prefix + ' ' + header
 
-    # add any kwargs passed as extensions
-    for k, v in kwargs.items():
-        header += '%s=%s ' % (k, v)
+    # We already have every value, so fill in the headers directly rather than parsing the line we're about to build
+    header_dict['Version'] = version
+    header_dict['DeviceVendor'] = dev_vendor
+    header_dict['DeviceProduct'] = dev_product
+    header_dict['DeviceVersion'] = dev_version
+    header_dict['DeviceEventClassID'] = dev_event_class_id
+    header_dict['Name'] = name
+    header_dict['Severity'] = severity
+
+    # add any kwargs passed as extensions, separated by spaces
+    extensions = ' '.join(['%s=%s' % (k, v) for k, v in kwargs.items()])
+    line = header + extensions
+
+    cefline = CEFMessage()
 
-    # remove the trailing space only if there were headers added
-    if len(kwargs) > 0:
-        header = header[:-1]
+    # Split the extensions lazily, exactly as parse_line would, so the created message matches the parsed line
+    cefline._raw_extensions = extensions
+    cefline._headers = header_dict
+    cefline._raw_line = line
+    cefline._raw_header = header
 
-    cefline = parse_line(header)
     return cefline
@@ -8,9 +8,31 @@ This module contains the underlying objects that make this package work
 :license: Apache 2.0, see LICENSE for more details.
 """
 
+import re
+
+from bisect import bisect_left, bisect_right
 from datetime import datetime
-from copy import deepcopy
+from operator import attrgetter
 from .exceptions import SyslogPrefixError
+from .utils import parse_syslog_timestamp, split_extensions
+
+
+def _contains(text, query):
+    """ Returns True if ``text`` contains ``query``, or a match for it if ``query`` is a compiled regular expression
+
+    Plain strings are checked with ``in``, which is faster than running even a literal pattern through ``re``.
+    """
+    if isinstance(query, str):
+        return query in text
+    return query.search(text) is not None
+
+
+def _lowercase_query(query):
+    """ Returns ``query`` ready to be matched while ignoring case - strings are lowercased to match against lowercased
+    text, and compiled regular expressions are recompiled with ``re.IGNORECASE`` """
+    if isinstance(query, str):
+        return query.lower()
+    return re.compile(query.pattern, query.flags | re.IGNORECASE)
 
 
 class CEFLog(object):
@@ -20,10 +42,18 @@ class CEFLog(object):
     with some file-wide metadata
     """
 
+    __slots__ = (
+        'timerange', 'lines', '_has_syslog_prefix', '_timestamps'
+    )
+
     def __init__(self):
         self.timerange = None
 
         self.lines = []
+        # Whether the lines in this log have syslog prefixes, decided by the first line appended
+        self._has_syslog_prefix = None
+        # The timestamps of the lines in this log, in the same order, for finding where new lines belong
+        self._timestamps = []
 
     def __len__(self):
         return len(self.lines)
@@ -38,8 +68,8 @@ class CEFLog(object):
         :return: the timestamp of the first :class:`CEFMessage <CEFMessage>` in the log
         :rtype: datetime
         """
-        if not self.is_empty:
-            return self.lines[0].timestamp
+        if self._timestamps:
+            return self._timestamps[0]
         else:
             return None
 
@@ -53,8 +83,8 @@ class CEFLog(object):
         :return: the timestamp of the last :class:`CEFMessage <CEFMessage>` in the log
         :rtype: datetime
         """
-        if not self.is_empty:
-            return self.lines[-1].timestamp
+        if self._timestamps:
+            return self._timestamps[-1]
         else:
             return None
 
@@ -69,10 +99,7 @@ class CEFLog(object):
             has no lines
         :rtype: bool
         """
-        if len(self.lines) > 0:
-            return self.lines[0].has_syslog_prefix
-        else:
-            return False
+        return bool(self._has_syslog_prefix)
 
     @property
     def is_empty(self):
@@ -80,7 +107,8 @@ class CEFLog(object):
         return len(self.lines) == 0
 
     def __repr__(self):
-        return '<CEFLog [%s line%s]>' % (self.linecount, 's' if self.linecount != 1 else '')
+        line_count = len(self.lines)
+        return '<CEFLog [%s line%s]>' % (line_count, 's' if line_count != 1 else '')
 
     def __iter__(self):
         """ Allows you to use the log object as an iterator to interact with the messages. """
@@ -94,7 +122,8 @@ class CEFLog(object):
         """ Add a message to the log
 
         Add a :class:`CEFMessage <CEFMessage>` object to the log - messages are
-        guaranteed to be placed in ascending time order (i.e. older messages first, newest message last).
+        guaranteed to be placed in ascending time order (i.e. older messages first, newest message last). Appending
+        messages that are already in time order is cheapest, as each one is simply added to the end.
 
         :param line: The message to add
         :type line: :class:`CEFMessage <CEFMessage>`
@@ -102,88 +131,214 @@ class CEFLog(object):
         if not isinstance(line, CEFMessage):
             raise TypeError('Attempting to append %s to a CEFLog object' % type(line))
 
-        if line.has_syslog_prefix ^ self.has_syslog_prefix and not self.is_empty:
+        has_syslog_prefix = line.has_syslog_prefix
+        if self._has_syslog_prefix is not None and has_syslog_prefix != self._has_syslog_prefix:
             raise SyslogPrefixError('Cannot append lines with headers inconsistent with lines already present',
                                     line=line)
+
+        if has_syslog_prefix:
+            # Parse the timestamp before touching the log, in case it can't be
+            timestamp = line.timestamp
+            if not self._timestamps or timestamp >= self._timestamps[-1]:
+                # Lines usually arrive in time order, so this one most likely belongs at the end
+                self._timestamps.append(timestamp)
+                self.lines.append(line)
+            else:
+                # Insert after any lines with the same timestamp, so lines logged in the same second keep their order
+                index = bisect_right(self._timestamps, timestamp)
+                self._timestamps.insert(index, timestamp)
+                self.lines.insert(index, line)
         else:
             self.lines.append(line)
-            if self.has_syslog_prefix:
-                self.lines.sort(key=lambda l: l.timestamp)
 
-    def search_header(self, query, start_time=None, end_time=None):
+        # Only the first line added decides whether the log's lines have syslog prefixes
+        self._has_syslog_prefix = has_syslog_prefix
+
+    def extend(self, lines):
+        """ Add several messages to the log at once
+
+        Add each :class:`CEFMessage <CEFMessage>` object in ``lines`` to the log, as though by :meth:`append`, but
+        sort the log only once after all of them have been added. Nothing is added if any of the messages can't be.
+
+        :param lines: The messages to add
+        :type lines: iterable of :class:`CEFMessage <CEFMessage>`
+        """
+        lines = list(lines)
+        has_syslog_prefix = self._has_syslog_prefix
+        for line in lines:
+            if not isinstance(line, CEFMessage):
+                raise TypeError('Attempting to append %s to a CEFLog object' % type(line))
+            if has_syslog_prefix is None:
+                has_syslog_prefix = line.has_syslog_prefix
+            elif line.has_syslog_prefix != has_syslog_prefix:
+                raise SyslogPrefixError('Cannot append lines with headers inconsistent with lines already present',
+                                        line=line)
+
+        if not has_syslog_prefix:
+            self._has_syslog_prefix = has_syslog_prefix
+            self.lines.extend(lines)
+            return
+
+        # Parse every timestamp before touching the log, in case one of them can't be
+        timestamps = [line.timestamp for line in lines]
+        self._has_syslog_prefix = has_syslog_prefix
+        in_order = all(earlier <= later for earlier, later in zip(timestamps, timestamps[1:]))
+        if in_order and (not timestamps or not self._timestamps or self._timestamps[-1] <= timestamps[0]):
+            # The new lines all belong after the existing ones, already in order, so there's nothing to sort
+            self.lines.extend(lines)
+            self._timestamps.extend(timestamps)
+        else:
+            # The sort is stable, so lines with the same timestamp keep the order they were added in
+            self.lines.extend(lines)
+            self.lines.sort(key=attrgetter('timestamp'))
+            self._timestamps = [line.timestamp for line in self.lines]
+
+    def as_columns(self):
+        """ Returns the headers and extensions of the messages in this log as columns
+
+        Rather than one :class:`CEFMessage <CEFMessage>` per line, each header (and each extension) gets a single list
+        holding its value for every message, in the same order as the log. This is handy for scanning a single field
+        across the whole log, e.g. counting severities or filtering by vendor::
+
+            columns = log.as_columns()
+            high = [i for i, severity in enumerate(columns['Severity']) if severity >= 8]
+            sources = columns['Extensions']['src']
+
+        Messages that don't have a header or extension hold ``None`` in that column.
+
+        :return: a dict of header names to lists of values, with the extensions under ``'Extensions'`` as a dict of
+            extension keys to lists of values
+        :rtype: dict
+        """
+        line_count = len(self.lines)
+        columns = {}
+        extension_columns = {}
+
+        for index, line in enumerate(self.lines):
+            for key, value in line._headers.items():
+                if key not in columns:
+                    columns[key] = [None] * line_count
+                columns[key][index] = value
+            for key, value in line._extensions.items():
+                if key not in extension_columns:
+                    extension_columns[key] = [None] * line_count
+                extension_columns[key][index] = value
+
+        columns['Extensions'] = extension_columns
+        return columns
+
+    def _search_range(self, start_time, end_time):
+        """ Returns the lines of this log from ``start_time`` to ``end_time``, inclusive
+
+        Lines are kept in time order, so the ends of the range are found with a binary search over their timestamps.
+        Every line is returned for logs whose entries do not have syslog prefixes.
+        """
+        if not self.has_syslog_prefix:
+            return self.lines
+
+        start = 0 if start_time is None else bisect_left(self._timestamps, start_time)
+        end = len(self._timestamps) if end_time is None else bisect_right(self._timestamps, end_time)
+        return self.lines[start:end]
+
+    def search_header(self, query, start_time=None, end_time=None, case_insensitive=False):
         """ Rudimentary search of the headers of the messages contained within this log
 
         Search through the headers of all messages present in this log for the value provided, optionally with a start
         and end timestamp. Timestamps will be ignored for logs whose entries do not have syslog prefixes.
 
-        :param query: The value for which to search
+        :param query: The value for which to search, or a compiled regular expression to search for matches of
         :param start_time: (optional) a start time to search from - defaults to time of first message in log if
             not provided
         :param end_time: (optional) an end time to search to - defaults to time of last message in log if not provided
-        :type query: str
+        :param case_insensitive: (optional) Ignore case when matching, False by default
+        :type query: str or :class:`re.Pattern`
         :type start_time: datetime
         :type end_time: datetime
+        :type case_insensitive: bool
         :return: a list of log messages that contain the provided query, if any
         :rtype: list of :class:`CEFMessage <CEFMessage>` if results were found, else ``None``
         """
-        if self.has_syslog_prefix:
-            if start_time is None:
-                start_time = self.start_time
-            if end_time is None:
-                end_time = self.end_time
-            search_range = [line for line in self.lines if start_time <= line.timestamp <= end_time]
-        else:
-            search_range = self.lines
+        results = list(self.search_header_iter(query, start_time, end_time, case_insensitive))
 
-        results = []
+        return results if len(results) > 0 else None
 
-        for line in search_range:
-            header_values = list(line.headers.values())
-            if len([value for value in header_values if query in value]) > 0:
-                results.append(line)
+    def search_header_iter(self, query, start_time=None, end_time=None, case_insensitive=False):
+        """ Lazily search the headers of the messages contained within this log
 
-        return results if len(results) > 0 else None
+        Works like :meth:`search_header`, but yields each matching message as it is found rather than collecting all of
+        them first - e.g. ``next(log.search_header_iter(query), None)`` stops searching at the first match.
 
-    def search_extensions(self, query, start_time=None, end_time=None, include_keys=False):
+        :param query: The value for which to search, or a compiled regular expression to search for matches of
+        :param start_time: (optional) a start time to search from
+        :param end_time: (optional) an end time to search to
+        :param case_insensitive: (optional) Ignore case when matching
+        :type query: str or :class:`re.Pattern`
+        :type start_time: datetime
+        :type end_time: datetime
+        :type case_insensitive: bool
+        :return: the log messages that contain the provided query
+        :rtype: iterator of :class:`CEFMessage <CEFMessage>`
+        """
+        if case_insensitive:
+            query = _lowercase_query(query)
+
+        for line in self._search_range(start_time, end_time):
+            if line._headers_contain(query, case_insensitive):
+                yield line
+
+    def search_extensions(self, query, start_time=None, end_time=None, include_keys=False, case_insensitive=False):
         """ Rudimentary search of the extensions of the messages contained within this log
 
         Search through the extensions of all messages present in this log for the value provided, optionally with a
         start and end timestamp. Timestamps will be ignored for logs whose entries do not have syslog prefixes.
 
-        :param query: The value for which to search
+        :param query: The value for which to search, or a compiled regular expression to search for matches of
         :param start_time: (optional) A start time to search from - default to time of first message in log if not
             provided
         :param end_time: (optional) An end time to search to - defaults to time of last message in log if not provided
         :param include_keys: (optional) Search through the keys of the extensions in addition to their values, False by
             default
-        :type query: str
+        :param case_insensitive: (optional) Ignore case when matching, False by default
+        :type query: str or :class:`re.Pattern`
         :type start_time: datetime
         :type end_time: datetime
         :type include_keys: bool
+        :type case_insensitive: bool
         :return: a list of log messages that contain the provided query, if any
         :rtype: list of :class:`CEFMessage <CEFMessage>` if results were found, else ``None``
         """
-        if self.has_syslog_prefix:
-            if start_time is None:
-                start_time = self.start_time
-            if end_time is None:
-                end_time = self.end_time
-            search_range = [line for line in self.lines if start_time <= line.timestamp <= end_time]
-        else:
-            search_range = self.lines
+        results = list(self.search_extensions_iter(query, start_time, end_time, include_keys, case_insensitive))
 
-        results = []
+        return results if len(results) > 0 else None
 
-        for line in search_range:
-            extension_values = list(line.extensions.values())
-            extension_keys = list(line.extensions.keys())
-            if len([value for value in extension_values if query in value]) > 0:
-                results.append(line)
-            elif include_keys:
-                if len([key for key in extension_keys if query in key]) > 0:
-                    results.append(line)
+    def search_extensions_iter(self, query, start_time=None, end_time=None, include_keys=False,
+                               case_insensitive=False):
+        """ Lazily search the extensions of the messages contained within this log
 
-        return results if len(results) > 0 else None
+        Works like :meth:`search_extensions`, but yields each matching message as it is found rather than collecting all
+        of them first.
+
+        :param query: The value for which to search, or a compiled regular expression to search for matches of
+        :param start_time: (optional) A start time to search from
+        :param end_time: (optional) An end time to search to
+        :param include_keys: (optional) Search through the keys of the extensions in addition to their values
+        :param case_insensitive: (optional) Ignore case when matching
+        :type query: str or :class:`re.Pattern`
+        :type start_time: datetime
+        :type end_time: datetime
+        :type include_keys: bool
+        :type case_insensitive: bool
+        :return: the log messages that contain the provided query
+        :rtype: iterator of :class:`CEFMessage <CEFMessage>`
+        """
+        if case_insensitive:
+            query = _lowercase_query(query)
+
+        for line in self._search_range(start_time, end_time):
+            if line._extensions_contain(query, case_insensitive):
+                yield line
+            elif include_keys and line._extension_keys_contain(query, case_insensitive):
+                yield line
 
 
 class CEFMessage(object):
@@ -194,22 +349,86 @@ class CEFMessage(object):
     ``pourover.create_line()`` functions.
     """
 
-    __attrs__ = [
-        '_raw_line', '_raw_header', '_extensions', '_headers'
-    ]
+    __slots__ = (
+        '_raw_line', '_raw_header', '_raw_extensions', '_extension_dict', '_headers', '_timestamp',
+        '_header_haystack', '_extension_haystack', '_header_haystack_lower', '_extension_haystack_lower',
+        '_extension_keys_lower'
+    )
 
     def __init__(self):
         self._raw_line = None
         self._raw_header = None
-        self._extensions = {}
+        self._raw_extensions = ''
+        self._extension_dict = None
         self._headers = {}
+        self._timestamp = None
+        self._header_haystack = None
+        self._extension_haystack = None
+        self._header_haystack_lower = None
+        self._extension_haystack_lower = None
+        self._extension_keys_lower = None
 
     def __repr__(self):
         return '<CEFMessage [%s]>' % self._raw_header
 
+    @property
+    def _extensions(self):
+        """ The dict of extensions, split from the raw extensions the first time it is needed """
+        if self._extension_dict is None:
+            self._extension_dict = split_extensions(self._raw_extensions)
+        return self._extension_dict
+
+    @_extensions.setter
+    def _extensions(self, extensions):
+        self._extension_dict = extensions
+
     def __str__(self):
         return self._raw_line
 
+    def _headers_contain(self, query, case_insensitive=False):
+        """ Returns True if any header value matches ``query``, which must already be lowercase if
+        ``case_insensitive`` is set """
+        if not isinstance(query, str):
+            # Patterns run against each value on its own, so anchors and character classes can't reach into another
+            # value. Case-insensitive patterns are compiled with re.IGNORECASE, so the values don't need lowering
+            return any(query.search(str(value)) for value in self._headers.values())
+
+        if self._header_haystack is None:
+            # Join the values once, so every plain search after the first is a single substring scan. Newlines can't
+            # appear in a CEF line, so a query can't match across two values unless it contains one
+            self._header_haystack = '\n'.join([str(value) for value in self._headers.values()])
+        if not case_insensitive:
+            return query in self._header_haystack
+
+        if self._header_haystack_lower is None:
+            self._header_haystack_lower = self._header_haystack.lower()
+        return query in self._header_haystack_lower
+
+    def _extensions_contain(self, query, case_insensitive=False):
+        """ Returns True if any extension value matches ``query``, which must already be lowercase if
+        ``case_insensitive`` is set """
+        if not isinstance(query, str):
+            return any(query.search(str(value)) for value in self._extensions.values())
+
+        if self._extension_haystack is None:
+            self._extension_haystack = '\n'.join([str(value) for value in self._extensions.values()])
+        if not case_insensitive:
+            return query in self._extension_haystack
+
+        if self._extension_haystack_lower is None:
+            self._extension_haystack_lower = self._extension_haystack.lower()
+        return query in self._extension_haystack_lower
+
+    def _extension_keys_contain(self, query, case_insensitive=False):
+        """ Returns True if any extension key matches ``query``, which must already be lowercase if
+        ``case_insensitive`` is set """
+        keys = self._extensions.keys()
+        if case_insensitive and isinstance(query, str):
+            if self._extension_keys_lower is None:
+                self._extension_keys_lower = [key.lower() for key in keys]
+            keys = self._extension_keys_lower
+        return any(_contains(key, query) for key in keys)
+
     def replace(self, prefix=None, version=None, device_vendor=None, device_product=None, device_version=None,
                 device_event_class_id=None, name=None, severity=None, extensions=None):
         """ Returns a new :class:`CEFMessage <CEFMessage>` object cloned from this object, with values replaced with
@@ -231,7 +450,18 @@ class CEFMessage(object):
         ``device_vendor`` and ``device_version``, and will contain updated values for the ``src``
         and ``dest`` extensions, along with a new ``host`` extension.
         """
-        message = deepcopy(self)
+        # Everything but the two dicts is immutable, so only those need copying
+        message = CEFMessage()
+        message._raw_line = self._raw_line
+        message._raw_header = self._raw_header
+        message._raw_extensions = self._raw_extensions
+        message._headers = self._headers.copy()
+        if self._extension_dict is not None:
+            message._extensions = self._extension_dict.copy()
+        if prefix is None:
+            # The prefix isn't changing, so neither is the timestamp
+            message._timestamp = self._timestamp
+
         header_replacements = {
             'Prefix': prefix,
             'Version': version,
@@ -299,11 +529,8 @@ class CEFMessage(object):
 
     @property
     def extensions(self):
-        """ Returns the extensions, if present. """
-        if len(self._extensions) > 0:
-            return self._extensions
-        else:
-            return None
+        """ Returns the extensions as a dict, which is empty if there are none. """
+        return self._extensions
 
     @property
     def headers(self):
@@ -319,10 +546,7 @@ class CEFMessage(object):
         any line that **does not** have a syslog prefix. Lines without syslog prefixes cannot be added to CEFLog objects
         that contain any line that **does** have a syslog prefix.
         """
-        if 'Prefix' in self._headers:
-            return True
-        else:
-            return False
+        return 'Prefix' in self._headers
 
     @property
     def has_extensions(self):
@@ -337,18 +561,23 @@ class CEFMessage(object):
         present in the prefix. If the the object is in the future (ahead of ``utcnow()``, if we assume it came from the
         current calendar year), the year will be set to the previous year rather than assuming that the log is from the
         future.
+
+        The timestamp is only parsed the first time it is accessed.
         """
+        if self._timestamp is not None:
+            return self._timestamp
         if not self.has_syslog_prefix:
             return None
         else:
             # Pull only the timestamp from the prefix, ignore the hostname
-            timestamp = ' '.join(self._headers['Prefix'].split(' ')[:-1])
+            timestamp = self._headers['Prefix'].rpartition(' ')[0]
             # Parse the timestamp from the string, assume current year
-            timestamp = datetime.strptime(timestamp, '%b %d %H:%M:%S')
+            now = datetime.utcnow()
+            timestamp = parse_syslog_timestamp(timestamp, now.year)
 
             # assume that our logs are not from the future
-            if timestamp.replace(year=datetime.utcnow().year) > datetime.utcnow():
-                timestamp = timestamp.replace(year=datetime.utcnow().year - 1)
-            else:
-                timestamp = timestamp.replace(year=datetime.utcnow().year)
+            if timestamp > now:
+                timestamp = timestamp.replace(year=now.year - 1)
+
+            self._timestamp = timestamp
             return timestamp
@@ -7,3 +7,79 @@ This module contains utility functions for the pourover package
 :copyright: (c) 2018 by Zachary Hart
 :license: Apache 2.0, see LICENSE for more details
 """
+
+from datetime import datetime
+from sys import intern
+
+
+# month abbreviations as they appear in syslog timestamps
+SYSLOG_MONTHS = {
+    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+    'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12,
+}
+
+
+def parse_syslog_timestamp(timestamp, year):
+    """ Parse a syslog timestamp into a datetime
+
+    Syslog timestamps are in the ``%b %d %H:%M:%S`` format and carry no year, so the year to use must be provided. The
+    fields are picked out by hand rather than through ``datetime.strptime``, which is much slower - anything that
+    doesn't fit the usual shape (e.g. a lowercase month) falls back to ``strptime``.
+
+    :param timestamp: The timestamp portion of a syslog prefix, e.g. ``Apr 15 22:11:20``
+    :param year: The year the timestamp is from
+    :type timestamp: str
+    :type year: int
+    :return: The parsed timestamp
+    :rtype: datetime
+    """
+    try:
+        month, day, clock = timestamp.split()
+        hour, minute, second = clock.split(':')
+        return datetime(year, SYSLOG_MONTHS[month], int(day), int(hour), int(minute), int(second))
+    except (KeyError, ValueError):
+        return datetime.strptime(timestamp, '%b %d %H:%M:%S').replace(year=year)
+
+
+def is_escaped(line, pos, start=0):
+    """ Returns True if the character at ``pos`` is preceded by an odd number of backslashes (not looking past
+    ``start``) """
+    escapes = 0
+    while pos - escapes > start and line[pos - escapes - 1] == '\\':
+        escapes += 1
+    return escapes % 2 == 1
+
+
+def split_extensions(extensions):
+    """ Split the extensions of a CEF line into their key-value pairs
+
+    Walk the extensions once, finding each unescaped ``=``. The key of a pair is the token between the ``=`` and the
+    closest space before it, and its value runs up to the key of the next pair, so values may contain spaces.
+
+    :param extensions: The extensions portion of a CEF line, following the header
+    :type extensions: str
+    :return: The extensions, in the order they appear in the line
+    :rtype: dict
+    """
+    extension_dict = {}
+    key = None
+    value_start = 0
+    pos = extensions.find('=')
+    while pos != -1:
+        if not is_escaped(extensions, pos, value_start):
+            # An unescaped '=' with no space between it and the previous one belongs to the previous value
+            sep = extensions.rfind(' ', value_start, pos)
+            if key is None or sep != -1:
+                key_start = sep + 1
+                if key_start < pos:
+                    if key is not None:
+                        extension_dict[key] = extensions[value_start:key_start].rstrip()
+                    key = intern(extensions[key_start:pos])
+                    value_start = pos + 1
+
+        pos = extensions.find('=', pos + 1)
+
+    if key is not None:
+        extension_dict[key] = extensions[value_start:].rstrip()
+
+    return extension_dict
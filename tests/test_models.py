@@ -2,6 +2,10 @@
 
 """ Pourover's non-exhaustive test suite. """
 
+import re
+
+from datetime import datetime, timedelta
+
 import pourover
 import pytest
 
@@ -16,6 +20,19 @@ SAMPLE_EXPLODE = {
     'severity': 100,
     }
 
+
+class FixedDatetime(datetime):
+    """ A datetime whose ``utcnow()`` never moves, so syslog timestamps don't depend on when the tests are run """
+    @classmethod
+    def utcnow(cls):
+        return cls(2018, 6, 15)
+
+
+@pytest.fixture
+def fixed_clock(monkeypatch):
+    monkeypatch.setattr('pourover.models.datetime', FixedDatetime)
+
+
 class TestPourover:
 
     def test_factory_availability(self):
@@ -56,3 +73,244 @@ class TestPourover:
         assert not log.is_empty
         assert isinstance(log[0], pourover.CEFMessage)
 
+
+    def test_parse_escaped_header(self):
+        line = pourover.parse_line(r'CEF:0|Test\|Vendor|Test Product|Test Version|100|Test Name|100|msg=a|b')
+        assert line.device_vendor == r'Test\|Vendor'
+        assert line.device_product == 'Test Product'
+        assert line.extensions['msg'] == 'a|b'
+
+    def test_parse_incomplete_header(self):
+        with pytest.raises(pourover.CEFMessageError):
+            pourover.parse_line('CEF:0|Test Vendor|Test Product')
+
+    def test_parse_extension_values(self):
+        line = pourover.parse_line(r'CEF:0|Test Vendor|Test Product|Test Version|100|Test Name|100|msg=a b\=c src=1.1.1.1')
+        assert line.extensions['msg'] == r'a b\=c'
+        assert line.extensions['src'] == '1.1.1.1'
+
+    def test_parse_file(self, tmp_path):
+        logfile = tmp_path / 'test.log'
+        logfile.write_text('\n'.join([SAMPLE_LINE] * 100) + '\n')
+        log = pourover.parse_file(str(logfile))
+        assert len(log) == 100
+        assert log.has_syslog_prefix
+        parallel_log = pourover.parse_file(str(logfile), workers=2)
+        assert len(parallel_log) == 100
+        assert [str(line) for line in parallel_log] == [str(line) for line in log]
+
+    def test_create_correctness(self):
+        line = pourover.create_line(set_syslog_prefix=True, hostname='testhost', src='1.1.1.1', dst='1.1.1.2',
+                                    **SAMPLE_EXPLODE)
+        parsed = pourover.parse_line(str(line))
+        assert line.headers == parsed.headers
+        assert line.extensions == parsed.extensions
+        assert line._raw_header == parsed._raw_header
+
+    def test_create_round_trip_hostname(self):
+        line = pourover.create_line(set_syslog_prefix=True, hostname='my-host.example.com', src='1.1.1.1',
+                                    **SAMPLE_EXPLODE)
+        parsed = pourover.parse_line(str(line))
+        assert line.prefix == parsed.prefix
+        assert line.headers == parsed.headers
+        assert line.extensions == parsed.extensions
+        assert line.timestamp == parsed.timestamp
+
+    def test_create_invalid_integers(self):
+        for field in ('version', 'severity'):
+            for value in (3.7, True, None, 'one'):
+                with pytest.raises(pourover.UnsupportedValueError):
+                    pourover.create_line(**dict(SAMPLE_EXPLODE, **{field: value}))
+
+    def test_create_round_trip_separators(self):
+        for values in ({'dev_event_class_id': '1|2'}, {'name': 'N\\x'}, {'set_syslog_prefix': True, 'hostname': 'host'}):
+            line = pourover.create_line(**dict(SAMPLE_EXPLODE, **values))
+            parsed = pourover.parse_line(str(line))
+            assert line.headers == parsed.headers
+            assert line._raw_header == parsed._raw_header
+        for values in ({'name': 'N\\'}, {'dev_vendor': 'V\\|'}, {'set_syslog_prefix': True, 'hostname': 'h|x'},
+                       {'set_syslog_prefix': True, 'hostname': 'CEF:0'}):
+            with pytest.raises(pourover.UnsupportedValueError):
+                pourover.create_line(**dict(SAMPLE_EXPLODE, **values))
+
+    def test_log_repr(self):
+        log = pourover.CEFLog()
+        assert repr(log) == '<CEFLog [0 lines]>'
+        log.append(pourover.parse_line(SAMPLE_LINE))
+        assert repr(log) == '<CEFLog [1 line]>'
+
+    def test_log_append_inconsistent_prefix(self):
+        log = pourover.CEFLog()
+        log.append(pourover.parse_line(SAMPLE_LINE))
+        with pytest.raises(pourover.SyslogPrefixError):
+            log.append(pourover.create_line(**SAMPLE_EXPLODE))
+        assert len(log) == 1
+
+    def test_parse_non_cef(self):
+        with pytest.raises(pourover.CEFMessageError):
+            pourover.parse_line('Apr 15 22:11:20 testhost not a cef line')
+        with pytest.raises(pourover.CEFMessageError):
+            pourover.parse_line('a|b|c|d|e|f|g|msg=CEF:0')
+
+    def test_log_columns(self):
+        log = pourover.CEFLog()
+        log.append(pourover.create_line(src='1.1.1.1', **SAMPLE_EXPLODE))
+        log.append(pourover.create_line(dst='1.1.1.2', **SAMPLE_EXPLODE))
+        columns = log.as_columns()
+        assert columns['DeviceVendor'] == ['Test Vendor', 'Test Vendor']
+        assert columns['Severity'] == [100, 100]
+        assert columns['Extensions']['src'] == ['1.1.1.1', None]
+        assert columns['Extensions']['dst'] == [None, '1.1.1.2']
+
+    def test_parse_non_string(self):
+        with pytest.raises(TypeError):
+            pourover.parse_line(SAMPLE_LINE.encode())
+        with pytest.raises(TypeError):
+            pourover.parse_line(None)
+
+    def test_timestamp_replace(self):
+        line = pourover.parse_line(SAMPLE_LINE)
+        assert line.timestamp is line.timestamp
+        replaced = line.replace(prefix='Jan 01 00:00:00 testhost')
+        assert (replaced.timestamp.month, replaced.timestamp.day) == (1, 1)
+        assert (line.timestamp.month, line.timestamp.day) == (4, 15)
+
+    def test_log_append_order(self, fixed_clock):
+        log = pourover.CEFLog()
+        for prefix in ['Jan 03 00:00:00 a', 'Jan 01 00:00:00 b', 'Jan 02 00:00:00 c', 'Jan 01 00:00:00 d']:
+            log.append(pourover.parse_line(prefix + ' CEF:0|V|P|1|100|N|1|'))
+        assert [line.prefix[-1] for line in log] == ['b', 'd', 'c', 'a']
+
+    def test_parse_syslog_timestamp(self):
+        from pourover.utils import parse_syslog_timestamp
+        assert parse_syslog_timestamp('Apr 15 22:11:20', 2018) == datetime(2018, 4, 15, 22, 11, 20)
+        assert parse_syslog_timestamp('Apr  5 22:11:20', 2018) == datetime(2018, 4, 5, 22, 11, 20)
+        assert parse_syslog_timestamp('apr 05 22:11:20', 2018) == datetime(2018, 4, 5, 22, 11, 20)
+        with pytest.raises(ValueError):
+            parse_syslog_timestamp('Foo 15 22:11:20', 2018)
+
+    def test_log_extend(self, fixed_clock):
+        log = pourover.CEFLog()
+        log.append(pourover.parse_line('Jan 02 00:00:00 a CEF:0|V|P|1|100|N|1|'))
+        log.extend(pourover.parse_line(prefix + ' CEF:0|V|P|1|100|N|1|')
+                   for prefix in ['Jan 03 00:00:00 b', 'Jan 01 00:00:00 c', 'Jan 02 00:00:00 d'])
+        assert [line.prefix[-1] for line in log] == ['c', 'a', 'd', 'b']
+        log.append(pourover.parse_line('Jan 02 00:00:00 e CEF:0|V|P|1|100|N|1|'))
+        assert [line.prefix[-1] for line in log] == ['c', 'a', 'd', 'e', 'b']
+        with pytest.raises(pourover.SyslogPrefixError):
+            log.extend([pourover.create_line(**SAMPLE_EXPLODE)])
+        assert len(log) == 5
+
+    def test_log_search_range(self, fixed_clock):
+        log = pourover.CEFLog()
+        log.extend(pourover.parse_line('Jan 0%d 00:00:00 host CEF:0|V|P|1|100|N|1|src=1.1.1.%d' % (day, day))
+                   for day in range(1, 6))
+        results = log.search_extensions('1.1.1', start_time=log[1].timestamp, end_time=log[3].timestamp)
+        assert [line.extensions['src'] for line in results] == ['1.1.1.2', '1.1.1.3', '1.1.1.4']
+        assert len(log.search_extensions('1.1.1', start_time=log[3].timestamp)) == 2
+        assert log.search_extensions('1.1.1', end_time=log[0].timestamp - timedelta(seconds=1)) is None
+
+    def test_log_extend_in_order(self, fixed_clock):
+        log = pourover.CEFLog()
+        lines = [pourover.parse_line('Jan 0%d 00:00:00 host CEF:0|V|P|1|100|N|1|' % day) for day in range(1, 7)]
+        log.extend(lines[:2])
+        log.extend(lines[3:])
+        log.append(lines[2])
+        assert log.lines == lines
+
+    def test_log_search_header(self):
+        log = pourover.CEFLog()
+        log.append(pourover.parse_line(SAMPLE_LINE))
+        assert log.search_header('Vendor') == [log[0]]
+        assert log.search_header('100') == [log[0]]
+        assert log.search_header('Other') is None
+
+    def test_search_replaced(self):
+        log = pourover.CEFLog()
+        message = pourover.parse_line(SAMPLE_LINE)
+        log.append(message)
+        assert log.search_extensions('1.1.1.1') == [message]
+        replaced = message.replace(device_vendor='Other Vendor', extensions={'src': '2.2.2.2'})
+        log.append(replaced)
+        assert log.search_header('Other') == [replaced]
+        assert log.search_extensions('2.2.2.2') == [replaced]
+        assert log.search_extensions('src', include_keys=True) == [message, replaced]
+
+    def test_log_search_regex(self):
+        log = pourover.CEFLog()
+        log.append(pourover.parse_line(SAMPLE_LINE))
+        assert log.search_header(re.compile(r'^Test \w+ct$')) == [log[0]]
+        assert log.search_header(re.compile(r'Vendor.*Product')) is None
+        assert log.search_extensions(re.compile(r'1\.1\.1\.[12]$')) == [log[0]]
+        assert log.search_extensions(re.compile(r'^d'), include_keys=True) == [log[0]]
+
+    def test_log_search_regex_per_value(self):
+        log = pourover.CEFLog()
+        log.append(pourover.parse_line(SAMPLE_LINE))
+        # src is not the last extension, so anchors have to apply to each value on its own
+        assert log.search_extensions(re.compile(r'^1\.1\.1\.1$')) == [log[0]]
+        assert log.search_header(re.compile(r'^Test Vendor$')) == [log[0]]
+        # Patterns can't match across the boundary between two values
+        assert log.search_extensions(re.compile(r'1\.1\.1\.1\s1')) is None
+        assert log.search_extensions(re.compile(r'1\.1\.1\.1[^x]+2', re.S)) is None
+        assert log.search_header(re.compile(r'Vendor\sTest')) is None
+
+    def test_log_time_range(self):
+        log = pourover.CEFLog()
+        assert log.start_time is None and log.end_time is None
+        log.append(pourover.parse_line('Jan 02 00:00:00 host CEF:0|V|P|1|100|N|1|'))
+        log.append(pourover.parse_line('Jan 01 00:00:00 host CEF:0|V|P|1|100|N|1|'))
+        assert log.start_time == log[0].timestamp
+        assert log.end_time == log[1].timestamp
+        unprefixed = pourover.CEFLog()
+        unprefixed.append(pourover.create_line(**SAMPLE_EXPLODE))
+        assert unprefixed.start_time is None and unprefixed.end_time is None
+
+    def test_log_search_without_extensions(self):
+        log = pourover.CEFLog()
+        log.append(pourover.create_line(**SAMPLE_EXPLODE))
+        assert log.search_extensions('src', include_keys=True) is None
+
+    def test_log_search_iter(self):
+        log = pourover.CEFLog()
+        log.extend(pourover.parse_line(SAMPLE_LINE) for _ in range(3))
+        results = log.search_header_iter('Vendor')
+        assert next(results) is log[0]
+        assert list(results) == [log[1], log[2]]
+        assert next(log.search_extensions_iter('nothing'), None) is None
+
+    def test_log_search_case_insensitive(self):
+        log = pourover.CEFLog()
+        log.append(pourover.parse_line(SAMPLE_LINE))
+        assert log.search_header('test vendor') is None
+        assert log.search_header('test VENDOR', case_insensitive=True) == [log[0]]
+        assert log.search_header(re.compile('^TEST NAME$'), case_insensitive=True) == [log[0]]
+        assert log.search_extensions('SRC', include_keys=True, case_insensitive=True) == [log[0]]
+        assert log.search_extensions(re.compile('^SRC$'), include_keys=True, case_insensitive=True) == [log[0]]
+        assert log[0]._extension_keys_lower is not None
+        assert log.search_extensions('SRC', include_keys=True, case_insensitive=True) == [log[0]]
+
+    def test_empty_extensions(self):
+        line = pourover.create_line(**SAMPLE_EXPLODE)
+        assert line.extensions == {}
+        assert not line.has_extensions
+        assert 'src' not in line.extensions
+
+    def test_log_append_bad_timestamp(self):
+        log = pourover.CEFLog()
+        with pytest.raises(ValueError):
+            log.append(pourover.parse_line('Foo 15 22:11:20 testhost CEF:0|V|P|1|100|N|1|'))
+        assert log.is_empty
+        assert not log.has_syslog_prefix
+        log.append(pourover.create_line(**SAMPLE_EXPLODE))
+        assert len(log) == 1
+
+    def test_log_extend_bad_timestamp(self):
+        log = pourover.CEFLog()
+        with pytest.raises(ValueError):
+            log.extend([pourover.parse_line(SAMPLE_LINE),
+                        pourover.parse_line('Foo 15 22:11:20 testhost CEF:0|V|P|1|100|N|1|')])
+        assert log.is_empty
+        assert not log.has_syslog_prefix
+        log.extend([pourover.create_line(**SAMPLE_EXPLODE)])
+        assert len(log) == 1